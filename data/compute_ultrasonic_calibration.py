@@ -1,30 +1,51 @@
 #  Copyright (c) Michele De Stefano 2026.
 
+import argparse
+
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from matplotlib import pyplot as plt
 
-sns.set()
 
-data = pd.read_csv("ultrasonic-data.csv")
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Computes the ultrasonic sensor calibration coefficients"
+    )
+    parser.add_argument(
+        "--no-plot",
+        action="store_true",
+        help="print the coefficients without plotting the regression line",
+    )
+    args = parser.parse_args()
+
+    data = pd.read_csv("ultrasonic-data.csv")
+
+    # Degree-1 least squares fit. polyfit solves it through a scaled
+    # Vandermonde matrix, avoiding the normal equations, and returns the
+    # coefficients from the highest degree down.
+    m, q = np.polyfit(data["sensor"].values, data["real"].values, 1)
+
+    x = np.linspace(0, 100, 101)
+    y = q + m * x
+
+    print("Regression coefficients (y = q + m * x)")
+    print("-------------------------------------")
+    print(f"[q, m] = [{q}, {m}]")
 
-G = np.c_[np.ones(len(data)), data["sensor"].values]
-GtG = G.T @ G
-Gtd = G.T @ data["real"].values
+    if args.no_plot:
+        return
 
-m = np.linalg.solve(GtG, Gtd)
+    # Plotting libraries are heavy to import, so they are loaded only when
+    # needed
+    import seaborn as sns
+    from matplotlib import pyplot as plt
 
-x = np.linspace(0, 100, 101)
-G = np.c_[np.ones(len(x)), x]
-y = G @ m
+    sns.set()
+    ax = sns.lineplot(data, x="sensor", y="real", label="data")
+    ax.plot(x, y, label="Regression line")
+    ax.set_title("Real vs sensor measurement with regression")
+    ax.legend(loc="best")
+    plt.show()
 
-print("Regression coefficients (y = q + m * x)")
-print("-------------------------------------")
-print(f"[q, m] = {m}")
 
-ax = sns.lineplot(data, x="sensor", y="real", label="data")
-ax.plot(x, y, label="Regression line")
-ax.set_title("Real vs sensor measurement with regression")
-ax.legend(loc="best")
-plt.show()
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 #  Copyright (c) Michele De Stefano - 2026.
-import json
+import itertools
 import re
 import socket
-from collections import deque
+import time
 from collections.abc import Callable
 from contextlib import AbstractContextManager, suppress
+from typing import Any
 
 import cv2 as cv
 import numpy as np
+import orjson
 import requests as req
-import scipy.integrate
 from ultralytics import YOLO
 from ultralytics.engine.model import Model
 from ultralytics.engine.results import Results
@@ -45,8 +46,22 @@ class Car(AbstractContextManager):
         "bl",
         "br",
     ]
-    __heartbeat_re: re.Pattern = re.compile(r"\{Heartbeat\}")
-    __ok_re: re.Pattern = re.compile(r"\{ok\}")
+    # Messages periodically sent by the robot, that must be discarded
+    __keepalive_msgs: tuple[bytes, ...] = (b"{Heartbeat}", b"{ok}")
+    # Responses to the sensor requests. Group 1 captures the command ID, which
+    # is compared after matching, so that one compiled pattern serves every
+    # request of the same kind. Group 2, when present, is the reading.
+    __mpu_response_re: re.Pattern = re.compile(rb'\{"id":"([^"]*)",.+]\}')
+    __ultrasonic_response_re: re.Pattern = re.compile(
+        rb"\{(Ultrasonic_Value_Request_\d+)_(\d+)\}"
+    )
+    __obstacle_response_re: re.Pattern = re.compile(
+        rb"\{(Check_Obstacle_\d+)_(true|false)\}"
+    )
+    __ir_response_re: re.Pattern = re.compile(rb"\{(IR_\d+_\d+)_(\d+)\}")
+    __ground_response_re: re.Pattern = re.compile(
+        rb"\{(Leaves_the_ground_\d+)_(true|false)\}"
+    )
 
     __num_quant_steps: int = 1 << 16
 
@@ -56,20 +71,35 @@ class Car(AbstractContextManager):
     # +/- 250 deg/s quantized with 16 bit (it is about 1 / 131)
     __gyro_quantum: float = 500.0 / __num_quant_steps
 
-    __yolo_model: str = "yolo26n.pt"
+    # NOTE: The readings for the accelerations arrive with the wrong sign, so
+    # the sign change is folded into their scale factor
+    __accel_scale: float = -__accel_quantum
+
+    # Tracking model used when none is given
+    DEFAULT_YOLO_MODEL: str = "yolo26n.pt"
+    __yolo_model: str
     __vision_tracking_on: bool
 
     log: bool
     __state: str
     __dry_run: bool
-    __cmd_queue: deque
-    __recv_msg_queue: str
+    __pending_cmd: dict | None
+    __pending_overflow: bool
+    __cmd_ids: itertools.count
+    __recv_msg_queue: bytearray
+    __recv_chunk: memoryview
+    __recv_chunk_size: int = 4096
     __head_servo_angle: int
     __head_angle_scan_step: int = 10
+    __stop_check_period: float = 0.01  # seconds
     __a_offsets: np.ndarray
     __g_offsets: np.ndarray
     __capture_endpoint: str
+    __capture_timeout: float = 2.0  # seconds
     __socket: socket.socket
+    __sendall: Callable[[bytes], None]
+    __recv_into: Callable[[memoryview], int]
+    __socket_rcvbuf_size: int = 1 << 16
     __tracking_model: Model | None
 
     # Ultrasonic regression coefficients for sensor -> real measurement
@@ -83,27 +113,39 @@ class Car(AbstractContextManager):
         port: int = 100,
         log: bool = False,
         dry_run: bool = False,
+        yolo_model: str = DEFAULT_YOLO_MODEL,
     ):
         """
         Initializes the connection with the car.
 
         Args:
-            ip:      IP address (numeric or symbolic) of the car.
-            port:    Listening port on the car.
-            log:     Put this to True if you want to see logging information.
-            dry_run: Put this to True if you want to simulate commands without
-                     execution.
+            ip:         IP address (numeric or symbolic) of the car.
+            port:       Listening port on the car.
+            log:        Put this to True if you want to see logging
+                        information.
+            dry_run:    Put this to True if you want to simulate commands
+                        without execution.
+            yolo_model: YOLO model used for vision tracking. Any format
+                        supported by Ultralytics can be used, like a TensorRT
+                        engine or an OpenVINO model exported with
+                        `yolo export`.
         """
         super().__init__()
         self.__state = "stop"
         self.log = log
         self.__dry_run = dry_run
-        self.__cmd_queue = deque()
-        self.__recv_msg_queue = ""
+        self.__pending_cmd = None
+        self.__pending_overflow = False
+        # IDs are consecutive, but start from a random offset so that late
+        # responses to a previous connection cannot be mistaken for ours
+        self.__cmd_ids = itertools.count(int(np.random.randint(0, 1 << 32)))
+        self.__recv_msg_queue = bytearray()
+        self.__recv_chunk = memoryview(bytearray(self.__recv_chunk_size))
         self.__head_servo_angle = 90
         self.__a_offsets = np.zeros(3)
         self.__g_offsets = np.zeros(3)
         self.__capture_endpoint = f"http://{ip}/capture"
+        self.__yolo_model = yolo_model
         self.__tracking_model = None
         self.__vision_tracking_on = False
         if not dry_run:
@@ -111,7 +153,19 @@ class Car(AbstractContextManager):
             # Set a timeout of 2 seconds for all the blocking operations on
             # this socket
             self.__socket.settimeout(2)
+            # Room for bursts of heartbeats and responses. This must be set
+            # before connecting, so that it is taken into account for the
+            # TCP window negotiation.
+            self.__socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, self.__socket_rcvbuf_size
+            )
             self.__socket.connect((ip, port))
+            # Commands are small and a response is awaited for most of them,
+            # so they must not be delayed by Nagle's algorithm
+            self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Bound methods used on the hot paths
+            self.__sendall = self.__socket.sendall
+            self.__recv_into = self.__socket.recv_into
             self.__compute_mpu_offsets()
             self.set_head_angle()
 
@@ -181,9 +235,10 @@ class Car(AbstractContextManager):
         """
         if self.__dry_run:
             return np.array([])
-        r = req.get(self.__capture_endpoint)
-        frame = np.asarray(bytearray(r.content), dtype=np.int8)
-        return cv.imdecode(frame, cv.IMREAD_UNCHANGED)
+        r = req.get(self.__capture_endpoint, timeout=self.__capture_timeout)
+        # Zero-copy view on the JPEG payload
+        jpeg = np.frombuffer(r.content, dtype=np.uint8)
+        return cv.imdecode(jpeg, cv.IMREAD_UNCHANGED)
 
     def track(self, frame: np.ndarray, **kwargs) -> list[Results]:
         """
@@ -199,11 +254,10 @@ class Car(AbstractContextManager):
         Returns:
             List of results obtained from a YOLO model.
         """
-        results = (
-            self.__tracking_model.track(frame, **kwargs)
-            if self.__tracking_model
-            else []
-        )
+        # The model is read once, as vision tracking may be toggled by
+        # another thread while tracking is in progress
+        model = self.__tracking_model
+        results = model.track(frame, **kwargs) if model else []
         return results
 
     def request_mpu_data(self) -> str:
@@ -213,7 +267,7 @@ class Car(AbstractContextManager):
         Returns:
             The ID of the command that was sent.
         """
-        cmd_id = f"MPU_Request_{np.random.randint(0, 1 << 32)}"
+        cmd_id = f"MPU_Request_{next(self.__cmd_ids)}"
         cmd = {"H": cmd_id, "N": 1000}
         self.__send_cmd(cmd)
         return cmd_id
@@ -241,18 +295,19 @@ class Car(AbstractContextManager):
                                   # per second) around the three axes
             }
 
+            The "a" and "g" values are NumPy arrays with 3 elements.
+
             The reference system is right handed, with x pointing to the right,
             y pointing to the front, and z pointing upwards. The angular
             velocities are positive when the rotation is counter-clockwise
             around the corresponding axis.
         """
-        expected_pattern = f'{{"id":"{id_str}",.+]}}'
-        data = json.loads(self.__recv_until_confirmation(expected_pattern))
+        m = self.__recv_until_response(self.__mpu_response_re, id_str)
+        data = orjson.loads(m.group(0))
         data["t"] *= 0.001  # Convert to seconds
-        # NOTE: The readings for the accelerations arrive with the
-        # wrong sign, so I have to change it
-        data["a"] = [-x * self.__accel_quantum for x in data["a"]]
-        data["g"] = [x * self.__gyro_quantum for x in data["g"]]
+        # Raw readings are the 16 bit integers returned by the MPU6050
+        data["a"] = np.array(data["a"], dtype=np.int16) * self.__accel_scale
+        data["g"] = np.array(data["g"], dtype=np.int16) * self.__gyro_quantum
         if self.log:  # pragma: no cover
             print(f"Retrieved MPU data: {data}")
         return data
@@ -271,14 +326,15 @@ class Car(AbstractContextManager):
     def __compute_mpu_offsets(self):
         if self.log:  # pragma: no cover
             print("Computing MPU offsets ...")
-        accelerations = []
-        omegas = []
-        for _ in range(30):  # Acquire 30 measurements
+        num_measurements = 30
+        accelerations = np.empty((num_measurements, 3))
+        omegas = np.empty((num_measurements, 3))
+        for i in range(num_measurements):
             d = self.get_mpu_data()
-            accelerations += [d["a"]]
-            omegas += [d["g"]]
-        self.__a_offsets = np.mean(accelerations, axis=0)
-        self.__g_offsets = np.mean(omegas, axis=0)
+            accelerations[i] = d["a"]
+            omegas[i] = d["g"]
+        self.__a_offsets = accelerations.mean(axis=0)
+        self.__g_offsets = omegas.mean(axis=0)
         if self.log:  # pragma: no cover
             print(f"acceleration offsets: {self.__a_offsets}")
             print(f"gyro offsets: {self.__g_offsets}")
@@ -291,13 +347,11 @@ class Car(AbstractContextManager):
             The reading (in cm) of the ultrasonic sensor. The reading is clipped
             to 150cm directly by the onboard software.
         """
-        cmd_id = f"Ultrasonic_Value_Request_{np.random.randint(0, 1 << 32)}"
+        cmd_id = f"Ultrasonic_Value_Request_{next(self.__cmd_ids)}"
         cmd = {"H": cmd_id, "N": 21, "D1": 2}
         self.__send_cmd(cmd)
-        pattern = rf"{{{cmd_id}_(\d+)}}"
-        recv_message = self.__recv_until_confirmation(pattern)
-        m = re.search(pattern, recv_message)
-        sensor_value = float(m.group(1))
+        m = self.__recv_until_response(self.__ultrasonic_response_re, cmd_id)
+        sensor_value = float(m.group(2))
         real_distance = self.__ultrasonic_q + self.__ultrasonic_m * sensor_value
         if self.log:  # pragma: no cover
             print(f"Ultrasonic distance: {real_distance}")
@@ -310,13 +364,11 @@ class Car(AbstractContextManager):
         Returns:
             True if there is an obstacle. False otherwise.
         """
-        cmd_id = f"Check_Obstacle_{np.random.randint(0, 1 << 32)}"
+        cmd_id = f"Check_Obstacle_{next(self.__cmd_ids)}"
         cmd = {"H": cmd_id, "N": 21, "D1": 1}
         self.__send_cmd(cmd)
-        pattern = f"{{{cmd_id}_(true|false)}}"
-        recv_message = self.__recv_until_confirmation(pattern)
-        m = re.search(pattern, recv_message)
-        return m.group(1) == "true"
+        m = self.__recv_until_response(self.__obstacle_response_re, cmd_id)
+        return m.group(2) == b"true"
 
     def get_ir_value(self, sensor: int) -> int:
         """
@@ -325,13 +377,11 @@ class Car(AbstractContextManager):
         Returns:
             The value read by the requested IR sensor.
         """
-        cmd_id = f"IR_{sensor}_{np.random.randint(0, 1 << 32)}"
+        cmd_id = f"IR_{sensor}_{next(self.__cmd_ids)}"
         cmd = {"H": cmd_id, "N": 22, "D1": sensor}
         self.__send_cmd(cmd)
-        pattern = rf"{{{cmd_id}_(\d+)}}"
-        recv_message = self.__recv_until_confirmation(pattern)
-        m = re.search(pattern, recv_message)
-        return int(m.group(1))
+        m = self.__recv_until_response(self.__ir_response_re, cmd_id)
+        return int(m.group(2))
 
     def get_ir_all(self) -> dict:
         """
@@ -358,13 +408,11 @@ class Car(AbstractContextManager):
             True if the car is far from the ground. False otherwise.
             The result is deduced from the IR sensor readings.
         """
-        cmd_id = f"Leaves_the_ground_{np.random.randint(0, 1 << 32)}"
+        cmd_id = f"Leaves_the_ground_{next(self.__cmd_ids)}"
         cmd = {"H": cmd_id, "N": 23}
         self.__send_cmd(cmd)
-        pattern = f"{{{cmd_id}_(true|false)}}"
-        recv_message = self.__recv_until_confirmation(pattern)
-        m = re.search(pattern, recv_message)
-        return m.group(1) == "true"
+        m = self.__recv_until_response(self.__ground_response_re, cmd_id)
+        return m.group(2) == b"true"
 
     def set_mode(self, mode: int) -> None:
         """
@@ -381,11 +429,10 @@ class Car(AbstractContextManager):
         """
         Clears all states in execution.
         """
-        cmd_id = f"clear_all_states_{np.random.randint(0, 1 << 32)}"
+        cmd_id = f"clear_all_states_{next(self.__cmd_ids)}"
         cmd = {"H": cmd_id, "N": 110}
         self.__send_cmd(cmd)
-        expected_pattern = f"{{{cmd_id}_ok}}"
-        self.__recv_until_confirmation(expected_pattern)
+        self.__recv_until_token(f"{{{cmd_id}_ok}}".encode())
 
     def forward(self, speed: int = 50, lazy: bool = False) -> None:
         """
@@ -463,7 +510,8 @@ class Car(AbstractContextManager):
             t = mpu_data["t"]
             delta_t = t - t0
             wz = mpu_data["g"][-1] - self.__g_offsets[-1]
-            delta_angle = scipy.integrate.trapezoid([wz0, wz], dx=delta_t)
+            # Trapezoidal rule over the last sampling interval
+            delta_angle = 0.5 * (wz0 + wz) * delta_t
             alpha += delta_angle
             if self.log:  # pragma: no cover
                 print(f"delta_t = {delta_t}")
@@ -477,6 +525,31 @@ class Car(AbstractContextManager):
         if self.log:  # pragma: no cover
             print("====== END TURNING ======")
 
+    @staticmethod
+    def integrate_angular_velocity(
+        t: np.ndarray, omega: np.ndarray
+    ) -> np.ndarray:
+        """
+        Integrates a sequence of angular velocity readings with the
+        trapezoidal rule, as turn_by does sample by sample. This is useful
+        for the offline analysis of recorded MPU data.
+
+        Args:
+            t:      The acquisition times (in seconds) of the readings.
+
+            omega:  The angular velocities (in degrees per second) around one
+                    axis, with the same length as t.
+
+        Returns:
+            The cumulative rotation angle (in degrees) at each acquisition
+            time. The first element is always 0.
+        """
+        t = np.asarray(t, dtype=np.float64)
+        omega = np.asarray(omega, dtype=np.float64)
+        angles = np.zeros_like(t)
+        np.cumsum(0.5 * (omega[1:] + omega[:-1]) * np.diff(t), out=angles[1:])
+        return angles
+
     def forward_left(self, speed: int = 50, lazy: bool = False) -> None:
         """
         Turns left while moving forward.
@@ -544,13 +617,14 @@ class Car(AbstractContextManager):
 
         Args:
             has_to_stop:    A callable that returns True when the robot has to
-                            stop.
+                            stop. It is checked every 10 milliseconds.
 
             speed:          Speed [0,255] of the car.
         """
         self.forward(speed)
         while not has_to_stop():
-            ...
+            # Do not spin: leave the CPU to other threads between checks
+            time.sleep(self.__stop_check_period)
         self.stop()
 
     def turn_head(self, delta: int, lazy: bool = False) -> None:
@@ -594,28 +668,28 @@ class Car(AbstractContextManager):
 
     def move(self) -> None:
         """
-        Applies all the lazy movement commands previously issued.
-        Lazy commands are stacked into a queue and then the queue is
-        progressively depleted.
+        Applies the lazy movement command previously issued.
+        Lazy commands are kept pending until this method is called.
         This behavior is handy for interactive remote control (video-game
         style).
 
         Warning:
-            If more than one movement command is in the queue then the car
-            is stopped and the queue is cleared. This is because the car is not
-            able to deal with more than one command at the same time.
-        """
-        num_cmd_received = len(self.__cmd_queue)
-        if num_cmd_received == 0:
+            If more than one movement command is pending then all of them are
+            discarded. This is because the car is not able to deal with more
+            than one command at the same time.
+            If no command is pending, the car is stopped.
+        """
+        pending_cmd = self.__pending_cmd
+        overflow = self.__pending_overflow
+        self.__pending_cmd = None
+        self.__pending_overflow = False
+        # TODO: Discarding the commands when more than one is pending is not
+        # TODO: the correct behavior. At present I did not manage to properly
+        # TODO: manage the command queue.
+        if pending_cmd is None:
             self.stop()
-        elif num_cmd_received > 1:
-            # TODO: This action should be removed because it is not the
-            # TODO: correct behavior. At present I did not manage to properly
-            # TODO: manage the command queue.
-            self.__cmd_queue.clear()
-        while len(self.__cmd_queue) > 0:
-            new_state_cmd = self.__cmd_queue.popleft()
-            self.__change_state_to(new_state_cmd)
+        elif not overflow:
+            self.__change_state_to(pending_cmd)
 
     def find_best_front_direction(
         self, scan_range: tuple[int, int] = (-80, 80)
@@ -660,8 +734,8 @@ class Car(AbstractContextManager):
             max_angle + self.__head_angle_scan_step,
             self.__head_angle_scan_step,
         )
-        distances = []
-        for cur_angle in scan_angles:
+        distances = np.empty(len(scan_angles))
+        for i, cur_angle in enumerate(scan_angles):
             self.set_head_angle(cur_angle)
             try_getting_obstacle_dist = True
             obstacle_dist = None
@@ -673,13 +747,12 @@ class Car(AbstractContextManager):
                     # try_getting_obstacle_dist stays True
                     # so we will retry at the next loop
                     pass
-            distances += [obstacle_dist]
-        distances = np.array(distances)
-        ind_best_dir = round(
-            np.argwhere(distances == distances.max()).ravel().mean()
-        )
+            distances[i] = obstacle_dist
+        # When more directions share the maximum distance, take the middle one
+        ties = np.flatnonzero(distances == distances.max())
+        ind_best_dir = ties[len(ties) // 2]
         self.set_head_angle(0)
-        return scan_angles[ind_best_dir], distances[ind_best_dir]
+        return scan_angles[ind_best_dir], float(distances[ind_best_dir])
 
     def turn_to_best_direction(
         self, angle: int | None = None
@@ -739,43 +812,96 @@ class Car(AbstractContextManager):
             return
         self.__send_cmd(state_cmd)
         if wait_for_confirmation:
-            self.__recv_until_confirmation("{" + new_state + "_ok}")
+            self.__recv_until_token(f"{{{new_state}_ok}}".encode())
         if set_head_cmd:
             self.__head_servo_angle = state_cmd["D2"]
         self.__state = new_state
 
     def __send_cmd(self, cmd_data: dict) -> None:
-        json_cmd = json.dumps(cmd_data).encode()
+        json_cmd = orjson.dumps(cmd_data)
         if not self.__dry_run:
-            self.__socket.sendall(json_cmd)
+            self.__sendall(json_cmd)
         if self.log:  # pragma: no cover
             print(f"Sent command: {json_cmd}")
 
-    def __recv_until_confirmation(self, expected_confirmation: str) -> str:
+    def __recv_until_response(
+        self, response_re: re.Pattern, cmd_id: str
+    ) -> re.Match | None:
+        # Waits for the response of the given kind to the given command
         if self.__dry_run:
-            return ""
-        pattern = re.compile(expected_confirmation)
-        m = pattern.search(self.__recv_msg_queue)
-        while not m:
-            self.__recv_msg_queue += self.__socket.recv(4096).decode()
-            # Remove all received {Heartbeat} messages
-            self.__recv_msg_queue = self.__heartbeat_re.sub(
-                "", self.__recv_msg_queue
-            )
-            # Remove all received {ok} messages
-            self.__recv_msg_queue = self.__ok_re.sub("", self.__recv_msg_queue)
-            m = pattern.search(self.__recv_msg_queue)
-            if self.log:  # pragma: no cover
-                print(f"Received message: {self.__recv_msg_queue}")
-        self.__recv_msg_queue = pattern.sub("", self.__recv_msg_queue)
-        return m.group(0)
+            return None
+        expected_id = cmd_id.encode()
+        fullmatch = response_re.fullmatch
+
+        def accept(msg: bytes) -> re.Match | None:
+            m = fullmatch(msg)
+            return m if m and m.group(1) == expected_id else None
+
+        return self.__recv_until(accept)
+
+    def __recv_until_token(self, token: bytes) -> None:
+        # Fast path for confirmations that are plain literals
+        if self.__dry_run:
+            return
+        self.__recv_until(lambda msg: msg == token)
+
+    def __recv_until(self, accept: Callable[[bytes], Any]) -> Any:
+        # Waits for the first message for which accept returns a truthy value
+        # and returns that value. Other messages are left in the queue.
+        buf = self.__recv_msg_queue
+        recv_into = self.__recv_into
+        chunk = self.__recv_chunk
+        next_message = self.__next_message
+        keepalive_msgs = self.__keepalive_msgs
+        pos = 0
+        while True:
+            span = next_message(pos)
+            if span is None:
+                num_bytes = recv_into(chunk)
+                buf += chunk[:num_bytes]
+                # Keepalives are dropped in bulk as soon as they arrive, so
+                # that the framer never has to visit them. Nothing before pos
+                # can be part of one of them.
+                unframed = buf[pos:]
+                for msg in keepalive_msgs:
+                    unframed = unframed.replace(msg, b"")
+                buf[pos:] = unframed
+                if self.log:  # pragma: no cover
+                    print(f"Received message: {buf.decode()}")
+                continue
+            start, end = span
+            # Whatever precedes the message is not part of any complete one
+            del buf[pos:start]
+            end -= start - pos
+            start = pos
+            msg = bytes(buf[start:end])
+            result = accept(msg)
+            if result:
+                del buf[start:end]
+                return result
+            pos = end
+
+    def __next_message(self, pos: int) -> tuple[int, int] | None:
+        # Messages never contain nested braces, so a message ends at the first
+        # "}" after its "{". If another "{" comes before that "}", then the
+        # preceding bytes are a truncated message and we resync on the last
+        # "{".
+        buf = self.__recv_msg_queue
+        start = buf.find(b"{", pos)
+        if start < 0:
+            return None
+        end = buf.find(b"}", start)
+        if end < 0:
+            return None
+        return buf.rfind(b"{", start, end), end + 1
 
     def __process_cmd(self, cmd: dict, lazy: bool) -> None:
         if lazy:
-            self.__cmd_queue += [cmd]
+            self.__pending_overflow |= self.__pending_cmd is not None
+            self.__pending_cmd = cmd
             return
         self.__send_cmd(cmd)
         new_state = cmd["H"]
         wait_for_confirmation = new_state not in self.__no_response_cmds
         if wait_for_confirmation:
-            self.__recv_until_confirmation("{" + new_state + "_ok}")
+            self.__recv_until_token(f"{{{new_state}_ok}}".encode())
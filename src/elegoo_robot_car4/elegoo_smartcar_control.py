@@ -1,8 +1,11 @@
 #  Copyright (c) Michele De Stefano - 2023.
 
 import argparse
-import functools as fun
+import queue
+import threading
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from typing import Any
 
 import cv2 as cv
@@ -16,6 +19,29 @@ from .person_follower import PersonFollower
 
 
 class GameEngine:
+    # Per-instance state only: attributes with a class-level value are shared
+    # constants
+    __slots__ = (
+        "__joysticks",
+        "__dry_run",
+        "__autonomous_mode",
+        "__key_move_cmds",
+        "__car",
+        "__display",
+        "__delta_speed",
+        "__last_track_results",
+        "__frames",
+        "__producer",
+        "__stop_producer",
+        "__producer_error",
+        "__clock",
+        "__menu_choices",
+        "__menu_reader",
+        "__person_follower",
+        "__run_person_follower",
+        "__draw_boxes",
+    )
+
     __joysticks: dict[int, pg.joystick.JoystickType]
     __head_delta: int = 10
     __min_speed: int = 50
@@ -24,27 +50,42 @@ class GameEngine:
     __dry_run_size: tuple[int, int] = (400, 200)
     __autonomous_mode: bool
 
-    __key_to_move_cmd: dict[int, Callable[[Car], Any]] = {
-        pg.K_UP: fun.partial(Car.forward, speed=__min_speed, lazy=True),
-        pg.K_DOWN: fun.partial(Car.backward, speed=__min_speed, lazy=True),
-        pg.K_LEFT: fun.partial(Car.left, speed=__min_speed, lazy=True),
-        pg.K_RIGHT: fun.partial(Car.right, speed=__min_speed, lazy=True),
-        pg.K_a: fun.partial(Car.turn_head, delta=__head_delta, lazy=True),
-        pg.K_d: fun.partial(Car.turn_head, delta=-__head_delta, lazy=True),
-        pg.K_s: fun.partial(Car.set_head_angle, lazy=True),
-    }
+    # Scanned in order at every frame, with no dict lookups
+    __key_move_cmds: tuple[tuple[int, Callable[[], Any]], ...]
 
     __axis_thr: float = 0.5
     __small_axis_thr: float = 0.1
 
     __car: Car
+    __display: pg.Surface
+    __delta_speed: int
 
     __last_track_results: list[Results]
+    __frames: queue.Queue[tuple[np.ndarray, list[Results]]]
+    __producer: threading.Thread | None
+    __stop_producer: threading.Event
+    __producer_error: Exception | None
+    # Longest wait for a new frame before the game loop polls the inputs
+    __frame_timeout: float = 0.05  # seconds
+    # Slightly more than the capture timeout, for the last in-flight capture
+    __producer_join_timeout: float = 5.0  # seconds
+    __clock: pg.time.Clock
+    __dry_run_fps: int = 30
+    __menu_choices: queue.Queue[int]
+    __menu_reader: threading.Thread | None
+    __box_color: tuple[int, int, int] = (0, 255, 0)
 
     __person_follower: PersonFollower
     __run_person_follower: bool
-
-    def __init__(self, robot_ip: str, log: bool = False, dry_run: bool = False):
+    __draw_boxes: bool
+
+    def __init__(
+        self,
+        robot_ip: str,
+        log: bool = False,
+        dry_run: bool = False,
+        yolo_model: str = Car.DEFAULT_YOLO_MODEL,
+    ):
         """
         Constructor.
 
@@ -55,12 +96,18 @@ class GameEngine:
 
             dry_run:    Set this to True for debugging purpose (no socket call
                         will be actually made).
+
+            yolo_model: YOLO model used for person tracking.
         """
         self.__joysticks = {}
         self.__dry_run = dry_run
         self.__autonomous_mode = False
         self.__run_person_follower = False
-        self.__car = Car(ip=robot_ip, log=log, dry_run=dry_run)
+        self.__draw_boxes = True
+        self.__car = Car(
+            ip=robot_ip, log=log, dry_run=dry_run, yolo_model=yolo_model
+        )
+        self.__key_move_cmds = self.__make_key_move_cmds(self.__car)
         self.__last_track_results = []
         # capture shape (height, width), OpenCV format
         capture_shape = np.array(
@@ -76,6 +123,42 @@ class GameEngine:
 
         self.__delta_speed = self.__max_speed - self.__min_speed
 
+        # Capture and tracking run on a producer thread, which keeps only the
+        # freshest frame for the game loop
+        self.__frames = queue.Queue(maxsize=1)
+        self.__stop_producer = threading.Event()
+        self.__producer_error = None
+        self.__producer = None
+        self.__clock = pg.time.Clock()
+        if not dry_run:
+            self.__producer = threading.Thread(
+                target=self.__produce_frames, daemon=True
+            )
+            self.__producer.start()
+
+        # The terminal menu is read by its own thread, so that the game loop
+        # keeps running while the user types
+        self.__menu_choices = queue.Queue()
+        self.__menu_reader = None
+
+    @classmethod
+    def __make_key_move_cmds(
+        cls, car: Car
+    ) -> tuple[tuple[int, Callable[[], Any]], ...]:
+        # Closures bound to the car instance are cheaper to call at every
+        # frame than partials of the unbound Car methods
+        speed = cls.__min_speed
+        delta = cls.__head_delta
+        return (
+            (pg.K_UP, lambda: car.forward(speed=speed, lazy=True)),
+            (pg.K_DOWN, lambda: car.backward(speed=speed, lazy=True)),
+            (pg.K_LEFT, lambda: car.left(speed=speed, lazy=True)),
+            (pg.K_RIGHT, lambda: car.right(speed=speed, lazy=True)),
+            (pg.K_a, lambda: car.turn_head(delta=delta, lazy=True)),
+            (pg.K_d, lambda: car.turn_head(delta=-delta, lazy=True)),
+            (pg.K_s, lambda: car.set_head_angle(lazy=True)),
+        )
+
     def __enter__(self):
         return self
 
@@ -84,30 +167,105 @@ class GameEngine:
 
     def __display_new_frame(self) -> None:
         if self.__dry_run:
+            # There are no frames to wait for, so the loop is paced here
+            self.__clock.tick(self.__dry_run_fps)
+            return
+        try:
+            # Waiting for the next frame also paces the game loop
+            frame, self.__last_track_results = self.__frames.get(
+                timeout=self.__frame_timeout
+            )
+        except queue.Empty:
+            if self.__producer_error is not None:
+                # Detections would never be refreshed again
+                self.__last_track_results = []
+                self.__run_person_follower = False
+                self.__car.stop()
+                raise RuntimeError(
+                    "Frame capture stopped"
+                ) from self.__producer_error
+            # No new frame since the last call, the display is left as is
             return
-        frame = self.__car.capture()
-        frame = self.__process_frame(frame)
+        frame_surface = self.__process_frame(frame)
         # blit it to the display surface.  simple!
-        pg.surfarray.blit_array(self.__display, frame)
+        self.__display.blit(frame_surface, (0, 0))
         pg.display.update()
 
-    def __process_frame(self, frame: np.ndarray) -> np.ndarray:
-        if self.__car.vision_tracking_is_on:
-            self.__last_track_results = self.__car.track(
+    def __produce_frames(self) -> None:
+        try:
+            self.__produce_frames_until_stopped()
+        except Exception as e:
+            # Handed to the game loop, which stops the car and re-raises it
+            self.__producer_error = e
+
+    def __produce_frames_until_stopped(self) -> None:
+        # The next frame is downloaded while the current one is tracked, so
+        # the camera round trip is hidden behind inference
+        with ThreadPoolExecutor(max_workers=1) as capture_pool:
+            next_frame = capture_pool.submit(self.__car.capture)
+            while not self.__stop_producer.is_set():
+                frame = next_frame.result()
+                next_frame = capture_pool.submit(self.__car.capture)
+                # Inference is skipped when nobody consumes its results
+                results = (
+                    self.__car.track(
+                        frame,
+                        classes=[0],
+                        conf=0.5,
+                        max_det=2,
+                        verbose=False,
+                        persist=True,
+                        # Ignored where FP16 isn't supported (e.g. on CPU)
+                        half=True,
+                    )
+                    if self.__run_person_follower or self.__draw_boxes
+                    else []
+                )
+                try:
+                    self.__frames.put_nowait((frame, results))
+                except queue.Full:
+                    # Drop the oldest frame. This is the only producer, so
+                    # the second put cannot fail.
+                    with suppress(queue.Empty):
+                        self.__frames.get_nowait()
+                    self.__frames.put_nowait((frame, results))
+
+    def __process_frame(self, frame: np.ndarray) -> pg.Surface:
+        if self.__draw_boxes:
+            for result in self.__last_track_results:
+                self.__draw_detections(frame, result)
+        # The BGR frame is wrapped by a surface with no copy. Channel order
+        # and pixel format are converted by the blit to the display.
+        return pg.image.frombuffer(frame, frame.shape[1::-1], "BGR")
+
+    def __draw_detections(self, frame: np.ndarray, result: Results) -> None:
+        # Overlays are drawn directly on the captured frame, instead of using
+        # Results.plot, which works on its own copy
+        boxes = result.boxes.cpu()
+        track_ids = (
+            boxes.id.int().tolist() if boxes.is_track else [None] * len(boxes)
+        )
+        for (x1, y1, x2, y2), conf, cls, track_id in zip(
+            boxes.xyxy.int().tolist(),
+            boxes.conf.tolist(),
+            boxes.cls.int().tolist(),
+            track_ids,
+            strict=True,
+        ):
+            label = f"{result.names[cls]} {conf:.2f}"
+            if track_id is not None:
+                label = f"id:{track_id} {label}"
+            cv.rectangle(frame, (x1, y1), (x2, y2), self.__box_color, 2)
+            cv.putText(
                 frame,
-                classes=[0],
-                conf=0.5,
-                max_det=2,
-                verbose=False,
-                persist=True,
+                label,
+                (x1, max(y1 - 5, 10)),
+                cv.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                self.__box_color,
+                1,
+                cv.LINE_AA,
             )
-            for result in self.__last_track_results:
-                frame = result.plot(img=frame)
-        else:
-            self.__last_track_results = []
-        # Returned frame must be ready to be consumed by pygame
-        frame = cv.transpose(cv.cvtColor(frame, cv.COLOR_BGR2RGB))
-        return frame
 
     def run(self) -> None:
         """
@@ -116,17 +274,24 @@ class GameEngine:
 
         while True:
             self.__display_new_frame()
-            events = pg.event.get()
-            if any([e.type == pg.QUIT for e in events]):
+            # A single SDL pump per frame: every event and keyboard state read
+            # below works on the queue as of this point
+            pg.event.pump()
+            events = pg.event.get(pump=False)
+            was_pressed = pg.key.get_pressed()
+            quit_requested, joystick_buttons = self.__detect_relevant_events(
+                events
+            )
+            if quit_requested:
                 break
 
             if self.__car.is_far_from_the_ground():
                 self.__car.stop()
                 continue
 
-            joystick_buttons = self.__detect_relevant_events(events)
-
-            keyboard_player_actions = self.__handle_keyboard_player_actions()
+            keyboard_player_actions = self.__handle_keyboard_player_actions(
+                was_pressed
+            )
             if keyboard_player_actions["command_received"] == "finish":
                 break
 
@@ -142,14 +307,23 @@ class GameEngine:
                 self.__car.move()
 
             if keyboard_player_actions["command_received"] == "terminal":
-                self.__handle_terminal_input()
+                self.__open_terminal_menu()
+
+            with suppress(queue.Empty):
+                self.__apply_menu_choice(self.__menu_choices.get_nowait())
 
             if self.__run_person_follower:
                 self.__person_follower.follow(self.__last_track_results)
 
-    def __detect_relevant_events(self, events: list[pg.Event]) -> list[int]:
+    def __detect_relevant_events(
+        self, events: list[pg.Event]
+    ) -> tuple[bool, list[int]]:
+        quit_requested = False
         joystick_buttons = []
         for e in events:
+            if e.type == pg.QUIT:
+                quit_requested = True
+
             # Handle hotplugging
             if e.type == pg.JOYDEVICEADDED:
                 # This event will be generated for every joystick when the
@@ -163,14 +337,15 @@ class GameEngine:
 
             if e.type == pg.JOYBUTTONDOWN:
                 joystick_buttons += [e.button]
-        return joystick_buttons
+        return quit_requested, joystick_buttons
 
-    def __handle_keyboard_player_actions(self) -> dict[str, int | str | None]:
+    def __handle_keyboard_player_actions(
+        self, was_pressed: pg.key.ScancodeWrapper
+    ) -> dict[str, int | str | None]:
         retval: dict[str, int | str | None] = {
             "command_received": None,
             "key": None,
         }
-        was_pressed = pg.key.get_pressed()
         if was_pressed[pg.K_ESCAPE]:
             retval["key"] = pg.K_ESCAPE
             retval["command_received"] = "finish"
@@ -178,9 +353,9 @@ class GameEngine:
             retval["key"] = pg.K_t
             retval["command_received"] = "terminal"
         else:
-            for key_cmd in self.__key_to_move_cmd:
+            for key_cmd, move_cmd in self.__key_move_cmds:
                 if was_pressed[key_cmd]:
-                    self.__key_to_move_cmd[key_cmd](self.__car)
+                    move_cmd()
                     retval["command_received"] = "movement"
                     retval["key"] = key_cmd
                     break
@@ -194,17 +369,6 @@ class GameEngine:
             head_axis = stick.get_axis(3)
             num_hats = stick.get_numhats()
             hat = stick.get_hat(0) if num_hats > 0 else None
-            # Use right trigger for tuning speed
-            speed_axis = 0.5 * (
-                stick.get_axis(5) + 1.0
-            )  # Now this is a number in [0,1]
-            cur_speed = round(
-                np.clip(
-                    self.__min_speed + speed_axis * self.__delta_speed,
-                    a_min=0,
-                    a_max=255,
-                )
-            )
 
             reset_head_pos = 2 in buttons  # 2 is the X button
             move_command_received = (
@@ -218,6 +382,17 @@ class GameEngine:
             if not move_command_received:
                 return move_command_received
 
+            # Use right trigger for tuning speed
+            speed_axis = 0.5 * (
+                stick.get_axis(5) + 1.0
+            )  # Now this is a number in [0,1]
+            cur_speed = round(
+                min(
+                    max(self.__min_speed + speed_axis * self.__delta_speed, 0),
+                    255,
+                )
+            )
+
             if head_axis < -self.__axis_thr:
                 self.__car.turn_head(self.__head_delta, lazy=True)
                 return move_command_received
@@ -267,7 +442,16 @@ class GameEngine:
 
         return command_received
 
-    def __handle_terminal_input(self) -> None:
+    def __open_terminal_menu(self) -> None:
+        if self.__menu_reader is not None and self.__menu_reader.is_alive():
+            # The menu is already waiting for the user's choice
+            return
+        self.__menu_reader = threading.Thread(
+            target=self.__read_menu_choice, daemon=True
+        )
+        self.__menu_reader.start()
+
+    def __read_menu_choice(self) -> None:
         print("Options:")
         print("========\n")
         print("0 - Clear all states")
@@ -278,6 +462,7 @@ class GameEngine:
         print(f"{Car.FOLLOW_MODE} - Activate (ultrasonic) follow mode")
         print("4 - Toggle person tracking mode")
         print("5 - Toggle person tracking and following mode")
+        print("6 - Toggle drawing of person tracking boxes")
         print()
 
         retry_input = True
@@ -285,12 +470,14 @@ class GameEngine:
         while retry_input:
             try:
                 user_choice = int(input("Enter your choice: "))
-                retry_input = not (0 <= user_choice <= 5)
+                retry_input = not (0 <= user_choice <= 6)
                 if retry_input:
-                    print("Please enter a number between 0 and 5")
+                    print("Please enter a number between 0 and 6")
             except Exception:
-                print("Please enter a number between 0 and 5")
+                print("Please enter a number between 0 and 6")
+        self.__menu_choices.put(user_choice)
 
+    def __apply_menu_choice(self, user_choice: int) -> None:
         if user_choice == 0:
             self.__autonomous_mode = False
             self.__run_person_follower = False
@@ -313,11 +500,17 @@ class GameEngine:
             )
             if toggle_vision_tracking:
                 self.__car.toggle_vision_tracking()
+        elif user_choice == 6:
+            self.__draw_boxes = not self.__draw_boxes
         else:
             self.__autonomous_mode = True
             self.__car.set_mode(user_choice)
 
     def release_resources(self):
+        self.__stop_producer.set()
+        if self.__producer is not None:
+            self.__producer.join(timeout=self.__producer_join_timeout)
+            self.__producer = None
         self.__car.disconnect()
 
 
@@ -347,6 +540,14 @@ def main() -> None:
         help="Run without sending any command to the car. "
         "Default: %(default)s.",
     )
+    parser.add_argument(
+        "--yolo-model",
+        dest="yolo_model",
+        type=str,
+        default=Car.DEFAULT_YOLO_MODEL,
+        help="YOLO model used for person tracking. Exported models (e.g. "
+        "TensorRT or OpenVINO) are supported. Default: %(default)s.",
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -367,7 +568,10 @@ def main() -> None:
     pg.init()
 
     with GameEngine(
-        args.robot_ip, log=args.log, dry_run=args.dry_run
+        args.robot_ip,
+        log=args.log,
+        dry_run=args.dry_run,
+        yolo_model=args.yolo_model,
     ) as engine:
         engine.run()
 
@@ -10,9 +10,15 @@ class PersonFollower:
     A simmple AI that is able to follow a person.
     """
 
+    __slots__ = (
+        "__car",
+        "__frame_center",
+        "__horizontal_threshold",
+        "__distance_threshold",
+    )
+
     __car: Car
-    __frame_shape: np.ndarray
-    __center: np.ndarray
+    __frame_center: tuple[float, float]
     __horizontal_threshold: float
     __distance_threshold: float
 
@@ -28,8 +34,10 @@ class PersonFollower:
                             format).
         """
         self.__car = car
-        self.__frame_center = frame_shape_hw[::-1] * 0.5
-        self.__horizontal_threshold = frame_shape_hw[1] * 0.15
+        # Plain floats, so that per-frame arithmetic is done on scalars
+        height, width = (float(d) for d in frame_shape_hw)
+        self.__frame_center = (width * 0.5, height * 0.5)
+        self.__horizontal_threshold = width * 0.15
         self.__distance_threshold = 0.4
 
     def follow(self, last_track_results: list[Results]) -> None:
@@ -44,16 +52,18 @@ class PersonFollower:
             return
         result = last_track_results[0]
         if result.boxes.xywh.numel() > 0:
-            box_xywh = result.boxes.xywh[0].cpu().numpy()
-            box_center = box_xywh[:2]
-            displacement = box_center - self.__frame_center
-            norm_box_area = np.prod(result.boxes.xywhn[0].cpu().numpy()[2:])
-            if abs(displacement[0]) < self.__horizontal_threshold:
+            # A single device-to-host transfer for the box. The normalized
+            # area is derived from it instead of transferring xywhn too.
+            box_x, _, box_w, box_h = result.boxes.xywh[0].tolist()
+            displacement_x = box_x - self.__frame_center[0]
+            frame_h, frame_w = result.orig_shape
+            norm_box_area = box_w * box_h / (frame_h * frame_w)
+            if abs(displacement_x) < self.__horizontal_threshold:
                 if norm_box_area < self.__distance_threshold:
                     self.__car.forward(speed=150, lazy=True)
                 else:
                     self.__car.stop(lazy=True)
-            elif displacement[0] > 0:
+            elif displacement_x > 0:
                 self.__car.right(lazy=True)
             else:
                 self.__car.left(lazy=True)
@@ -0,0 +1 @@
+#  Copyright (c) Michele De Stefano - 2026.
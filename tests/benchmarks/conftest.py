@@ -0,0 +1,19 @@
+#  Copyright (c) Michele De Stefano 2026.
+from collections.abc import Iterator
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from elegoo_robot_car4 import Car
+
+
+@pytest.fixture(scope="module")
+def car(
+    socket_patch: SimpleNamespace,
+    get_mpu_data_mock: MagicMock,
+    set_head_angle_mock: MagicMock,
+) -> Iterator[Car]:
+    # Commands go to the socket mock, so only their processing is measured
+    with Car() as car:
+        yield car
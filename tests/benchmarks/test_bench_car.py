@@ -0,0 +1,50 @@
+#  Copyright (c) Michele De Stefano - 2026.
+import numpy as np
+import pytest
+import torch
+from ultralytics.engine.results import Results
+
+from elegoo_robot_car4 import Car
+from elegoo_robot_car4.person_follower import PersonFollower
+
+_ORIG_IMG = np.broadcast_to(np.uint8(0), (600, 800, 3))
+
+# Boxes in (x1, y1, x2, y2, confidence, class) format
+_BOXES = {
+    "close": torch.tensor([[0.0, 0.0, 800.0, 600.0, 0.9, 0.0]]),
+    "far_away": torch.tensor([[398.0, 298.0, 402.0, 302.0, 0.9, 0.0]]),
+    "on_the_left": torch.tensor([[0.0, 298.0, 100.0, 302.0, 0.9, 0.0]]),
+    "on_the_right": torch.tensor([[700.0, 298.0, 800.0, 302.0, 0.9, 0.0]]),
+}
+
+
+def test_bench_move(benchmark, car: Car) -> None:
+    # given
+    def forward_and_move() -> None:
+        car.forward(speed=40, lazy=True)
+        car.move()
+
+    # when
+    # Stopping the car before every round makes move send the command
+    benchmark.pedantic(forward_and_move, setup=car.stop, rounds=1000)
+
+    # then
+    assert car.state == "fw_40"
+
+
+@pytest.mark.parametrize("position", _BOXES)
+def test_bench_follow(benchmark, car: Car, position: str) -> None:
+    # given
+    follower = PersonFollower(car, np.array([600, 800]))
+
+    def stop_and_detect() -> tuple[tuple[list[Results]], dict]:
+        car.stop()
+        # New results at every round, as in tracking, since the boxes cache
+        # their conversions
+        results = Results(
+            orig_img=_ORIG_IMG, path="", names={}, boxes=_BOXES[position]
+        )
+        return ([results],), {}
+
+    # when, then
+    benchmark.pedantic(follower.follow, setup=stop_and_detect, rounds=1000)
@@ -1,10 +1,135 @@
 #  Copyright (c) Michele De Stefano 2026.
 import importlib.resources
+import pickle
+from collections.abc import Callable, Iterator
 from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
 
+import numpy as np
 import pytest
+import requests as req
+
+from elegoo_robot_car4 import Car
 
 
 @pytest.fixture(scope="session")
 def resources_path() -> Path:
     return Path(str(importlib.resources.files("tests.resources")))
+
+
+class FakeSocket:
+    # Only the socket methods used by Car, each one a plain mock. Unlike a
+    # spec_set mock, building it doesn't introspect the whole socket API, while
+    # the slots still reject any other attribute.
+    __slots__ = (
+        "settimeout",
+        "setsockopt",
+        "connect",
+        "sendall",
+        "recv_into",
+        "close",
+    )
+
+    def __init__(self) -> None:
+        for name in self.__slots__:
+            setattr(self, name, MagicMock())
+
+    def reset_mock(self, **kwargs) -> None:
+        for name in self.__slots__:
+            getattr(self, name).reset_mock(**kwargs)
+
+
+@pytest.fixture(scope="module")
+def socket_patch(module_mocker) -> SimpleNamespace:
+    # The patched socket class (cls) and the fake socket it returns (instance)
+    socket_class_mock = module_mocker.patch(
+        "elegoo_robot_car4.car.socket.socket",
+        return_value=FakeSocket(),
+    )
+    return SimpleNamespace(
+        cls=socket_class_mock, instance=socket_class_mock.return_value
+    )
+
+
+def _make_mpu_samples(
+    num_samples: int,
+) -> tuple[dict[str, str | float | np.ndarray], ...]:
+    # One sample per second. The first 30 are supposed to be taken while the
+    # robot is still.
+    t = np.arange(num_samples, dtype=np.float64)
+    moving = t >= 30.0
+    a = np.zeros((num_samples, 3))
+    a[moving, 2] = -1.0  # robot is on a perfectly flat ground
+    g = np.zeros((num_samples, 3))
+    g[moving, 2] = 10.0  # 10 degrees/second to the left
+    # The samples are shared by all the tests, so they must not be modified
+    a.setflags(write=False)
+    g.setflags(write=False)
+    return tuple(
+        {"id": "MPU_Request_test", "t": float(t[i]), "a": a[i], "g": g[i]}
+        for i in range(num_samples)
+    )
+
+
+_MPU_SAMPLES = _make_mpu_samples(256)
+
+
+def mpu_data_generator(
+    t0: int = 0,
+) -> Iterator[dict[str, str | float | np.ndarray]]:
+    # Samples are one second apart, so t0 (seconds) is also the index of the
+    # first one
+    return iter(_MPU_SAMPLES[t0:])
+
+
+@pytest.fixture(scope="session")
+def mpu_data_stream() -> Callable[..., Iterator[dict]]:
+    # Every call starts a new stream of MPU samples
+    return mpu_data_generator
+
+
+@pytest.fixture(scope="module")
+def get_mpu_data_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(
+        Car,
+        "get_mpu_data",
+        side_effect=mpu_data_generator(),
+    )
+
+
+@pytest.fixture(scope="module")
+def set_head_angle_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(
+        Car,
+        "set_head_angle",
+    )
+
+
+@pytest.fixture(scope="session")
+def capture_response(resources_path: Path) -> req.Response:
+    response_file = resources_path / "capture-response.pkl"
+    return pickle.loads(response_file.read_bytes())
+
+
+@pytest.fixture(scope="module")
+def capture_request_mock(
+    module_mocker, capture_response: req.Response
+) -> MagicMock:
+    return module_mocker.patch(
+        "elegoo_robot_car4.car.req.get",
+        return_value=capture_response,
+    )
+
+
+@pytest.fixture(scope="module")
+def yolo_model_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch("elegoo_robot_car4.car.Model", autospec=True)
+
+
+@pytest.fixture(scope="module")
+def yolo_class_mock(module_mocker, yolo_model_mock: MagicMock) -> MagicMock:
+    return module_mocker.patch(
+        "elegoo_robot_car4.car.YOLO",
+        return_value=yolo_model_mock,
+    )
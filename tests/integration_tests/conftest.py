@@ -1,5 +1,4 @@
 #  Copyright (c) Michele De Stefano - 2026.
-import json
 import re
 import socket
 import socketserver
@@ -8,10 +7,14 @@ import time
 from collections.abc import Generator
 from typing import Any, override
 
+import orjson
 import pytest
 
 from elegoo_robot_car4 import Car
 
+_CMD_RE = re.compile(rb"\{.*?\}")
+_DIGIT_RE = re.compile(r"\d+")
+
 
 class RobotMockServer(socketserver.BaseRequestHandler):
     @override
@@ -21,27 +24,27 @@ class RobotMockServer(socketserver.BaseRequestHandler):
             data = self.request.recv(1024).strip()
             if not data:
                 break
-            commands = re.findall(r"\{.*?\}", data.decode("utf-8"))
+            commands = _CMD_RE.findall(data)
 
             for command in commands:
                 response = self.process_command(command)
                 if response:
-                    self.request.sendall(response.encode("utf-8"))
+                    self.request.sendall(response)
 
     @staticmethod
-    def process_command(command: str) -> str:
-        print(f"Process command: {command}\n")
-        cmd = json.loads(command)
+    def process_command(command: bytes) -> bytes:
+        print(f"Process command: {command.decode('utf-8')}\n")
+        cmd = orjson.loads(command)
         cmd_id = cmd.get("H")
         if cmd_id is None:
-            return ""
+            return b""
         cmd_code = cmd.get("N")
-        match = re.search(r"\d+", cmd_id)
+        match = _DIGIT_RE.search(cmd_id)
         code_number = int(match.group(0)) if match else None
         flag = "true" if (code_number and (code_number & 1 == 1)) else "false"
-        response_for_sensor_reading = f"{{{cmd_id}_123456}}"
-        response_for_check = f"{{{cmd_id}_{flag}}}"
-        response_ok = f"{{{cmd_id}_ok}}"
+        response_for_sensor_reading = f"{{{cmd_id}_123456}}".encode()
+        response_for_check = f"{{{cmd_id}_{flag}}}".encode()
+        response_ok = f"{{{cmd_id}_ok}}".encode()
         ok_response_codes = [5, 110]
 
         if cmd_code in ok_response_codes:
@@ -62,10 +65,10 @@ class RobotMockServer(socketserver.BaseRequestHandler):
                 "a": [110, 220, 330],  # Quantized values
                 "g": [440, 550, 660],  # Quantized values
             }
-            return json.dumps(response_data, separators=(",", ":"))
+            return orjson.dumps(response_data)
         else:
             # No response is expected
-            return ""
+            return b""
 
 
 @pytest.fixture(scope="session")
@@ -1,8 +1,6 @@
 #  Copyright (c) Michele De Stefano 2026.
-import pickle
-import socket
-from collections.abc import Iterator
-from pathlib import Path
+from collections.abc import Callable, Iterator
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 
 import numpy as np
@@ -11,123 +9,105 @@ import pytest
 from elegoo_robot_car4 import Car
 
 
-@pytest.fixture(scope="function")
-def socket_mock() -> MagicMock:
-    return MagicMock(spec_set=socket.socket)
-
+def reset_car_mocks(
+    car_mocks: dict[str, MagicMock], mpu_data: Iterator[dict]
+) -> None:
+    # Mocks shared across tests must not carry calls, configured behaviour or
+    # consumed MPU samples from previous tests
+    for mock in car_mocks.values():
+        mock.reset_mock()
+    car_mocks["socket"].reset_mock(return_value=True, side_effect=True)
+    car_mocks["get_mpu_data"].side_effect = mpu_data
 
-@pytest.fixture(scope="function")
-def socket_class_mock(mocker, socket_mock: MagicMock) -> MagicMock:
-    return mocker.patch(
-        "elegoo_robot_car4.car.socket.socket",
-        autospec=True,
-        return_value=socket_mock,
-    )
-
-
-def mpu_data_generator() -> Iterator[dict[str, str | float | list[float]]]:
-    t = 0.0  # seconds
-    while True:
-        # First 30 measurements are supposed to be taken while the robot is
-        # still
-        az = -1.0 if t >= 30.0 else 0.0
-        gz = 10.0 if t >= 30.0 else 0.0
-        yield {
-            "id": "MPU_Request_test",
-            "t": t,
-            "a": [0.0, 0.0, az],  # robot is on a perfectly flat ground
-            "g": [0.0, 0.0, gz],  # 10 degrees/second to the left
-        }
-        t += 1.0
 
-
-@pytest.fixture(scope="function")
-def get_mpu_data_mock(mocker) -> MagicMock:
-    return mocker.patch.object(
-        Car,
-        "get_mpu_data",
-        side_effect=mpu_data_generator(),
-    )
+@pytest.fixture(scope="module")
+def car_forward_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(Car, "forward")
 
 
-@pytest.fixture(scope="function")
-def set_head_angle_mock(mocker) -> MagicMock:
-    return mocker.patch.object(
-        Car,
-        "set_head_angle",
-    )
+@pytest.fixture(scope="module")
+def car_left_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(Car, "left")
 
 
-@pytest.fixture(scope="function")
-def car_forward_mock(mocker) -> MagicMock:
-    return mocker.patch.object(Car, "forward", autospec=True)
+@pytest.fixture(scope="module")
+def car_right_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(Car, "right")
 
 
-@pytest.fixture(scope="function")
-def car_left_mock(mocker) -> MagicMock:
-    return mocker.patch.object(Car, "left", autospec=True)
+@pytest.fixture(scope="module")
+def car_stop_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(Car, "stop")
 
 
-@pytest.fixture(scope="function")
-def car_right_mock(mocker) -> MagicMock:
-    return mocker.patch.object(Car, "right", autospec=True)
-
-
-@pytest.fixture(scope="function")
-def car_stop_mock(mocker) -> MagicMock:
-    return mocker.patch.object(Car, "stop", autospec=True)
-
-
-@pytest.fixture(scope="function")
-def car_move_mock(mocker) -> MagicMock:
-    return mocker.patch.object(Car, "move", autospec=True)
-
-
-@pytest.fixture(scope="function")
-def capture_request_mock(mocker, resources_path: Path) -> MagicMock:
-    response_file = resources_path / "capture-response.pkl"
-    with open(response_file, "rb") as f:
-        response = pickle.load(f)
-    return mocker.patch(
-        "elegoo_robot_car4.car.req.get",
-        autospec=True,
-        return_value=response,
-    )
-
-
-@pytest.fixture(scope="function")
-def yolo_model_mock(mocker) -> MagicMock:
-    return mocker.patch("elegoo_robot_car4.car.Model", autospec=True)
-
-
-@pytest.fixture(scope="function")
-def yolo_class_mock(mocker, yolo_model_mock: MagicMock) -> MagicMock:
-    return mocker.patch(
-        "elegoo_robot_car4.car.YOLO",
-        autospec=True,
-        return_value=yolo_model_mock,
-    )
+@pytest.fixture(scope="module")
+def car_move_mock(module_mocker) -> MagicMock:
+    return module_mocker.patch.object(Car, "move")
 
 
 @pytest.fixture(scope="function")
 def car_mocks(
-    socket_mock: MagicMock,
-    socket_class_mock: MagicMock,
+    socket_patch: SimpleNamespace,
     get_mpu_data_mock: MagicMock,
     set_head_angle_mock: MagicMock,
     capture_request_mock: MagicMock,
     yolo_model_mock: MagicMock,
     yolo_class_mock: MagicMock,
+    mpu_data_stream: Callable[..., Iterator[dict]],
 ) -> dict[str, MagicMock]:
-    return {
-        "socket": socket_mock,
-        "socket_class": socket_class_mock,
+    # Reset on request, so tests that don't use a connected car (e.g. the dry
+    # run ones) don't pay for the shared mocks
+    car_mocks = {
+        "socket": socket_patch.instance,
+        "socket_class": socket_patch.cls,
         "get_mpu_data": get_mpu_data_mock,
         "set_head_angle": set_head_angle_mock,
         "capture_request": capture_request_mock,
         "yolo_model_mock": yolo_model_mock,
         "yolo_class_mock": yolo_class_mock,
     }
+    reset_car_mocks(car_mocks, mpu_data_stream())
+    return car_mocks
+
+
+@pytest.fixture(scope="module")
+def shared_car(
+    socket_patch: SimpleNamespace,
+    get_mpu_data_mock: MagicMock,
+    set_head_angle_mock: MagicMock,
+    mpu_data_stream: Callable[..., Iterator[dict]],
+) -> Iterator[Car]:
+    # Built before the per-test reset of the mocks, so it needs its own MPU
+    # samples for the calibration
+    get_mpu_data_mock.side_effect = mpu_data_stream()
+    with Car() as car:
+        yield car
+
+
+@pytest.fixture(scope="function")
+def car(
+    shared_car: Car,
+    car_mocks: dict[str, MagicMock],
+    mpu_data_stream: Callable[..., Iterator[dict]],
+) -> Car:
+    # One calibrated car for the tests that don't check the construction. It
+    # is stopped with no pending command, and the MPU samples carry on from
+    # the end of the calibration.
+    shared_car.stop(lazy=True)
+    shared_car.move()
+    reset_car_mocks(car_mocks, mpu_data_stream(t0=30))
+    return shared_car
+
+
+@pytest.fixture(scope="function")
+def vision_car(car: Car, car_mocks: dict[str, MagicMock]) -> Car:
+    # The shared car, with vision tracking off and no YOLO model loaded by
+    # previous tests
+    if car.vision_tracking_is_on:
+        car.toggle_vision_tracking()
+    car_mocks["yolo_class_mock"].reset_mock()
+    car_mocks["yolo_model_mock"].reset_mock()
+    return car
 
 
 @pytest.fixture(scope="function")
@@ -139,16 +119,24 @@ def car_motion_mocks(
     car_stop_mock: MagicMock,
     car_move_mock: MagicMock,
 ) -> dict[str, MagicMock]:
-    car_mocks |= {
+    motion_mocks = {
         "car_forward": car_forward_mock,
         "car_left": car_left_mock,
         "car_right": car_right_mock,
         "car_stop": car_stop_mock,
         "car_move": car_move_mock,
     }
+    # Patched once per module, so they may carry calls from previous tests,
+    # including the ones resetting the shared car
+    for mock in motion_mocks.values():
+        mock.reset_mock()
+    car_mocks |= motion_mocks
     return car_mocks
 
 
-@pytest.fixture(scope="function")
+@pytest.fixture(scope="session")
 def frame_shape_hw() -> np.ndarray:
-    return np.array([600, 800])
+    frame_shape_hw = np.array([600, 800])
+    # Shared by all the tests, so it must not be modified
+    frame_shape_hw.setflags(write=False)
+    return frame_shape_hw
@@ -1,11 +1,36 @@
 #  Copyright (c) Michele De Stefano - 2026.
+import socket
+from collections.abc import Callable
 from unittest.mock import MagicMock
 
 import numpy as np
+import orjson
+import pytest
 
 from elegoo_robot_car4.car import Car
 
 
+def stream_to_socket(
+    socket_mock: MagicMock, *chunks: bytes | Callable[[bytes], bytes]
+) -> None:
+    # Each recv_into call delivers the next chunk, as a stream socket would.
+    # In bytes chunks <ID> stands for the ID of the last sent command, which is
+    # also the argument of callable chunks.
+    pending = iter(chunks)
+
+    def recv_into(buffer: memoryview) -> int:
+        last_cmd = orjson.loads(socket_mock.sendall.call_args.args[0])
+        cmd_id = last_cmd["H"].encode()
+        chunk = next(pending)
+        data = (
+            chunk(cmd_id) if callable(chunk) else chunk.replace(b"<ID>", cmd_id)
+        )
+        buffer[: len(data)] = data
+        return len(data)
+
+    socket_mock.recv_into.side_effect = recv_into
+
+
 def test_use_car_in_with_context(car_mocks: dict[str, MagicMock]) -> None:
     # given
     socket_mock = car_mocks["socket"]
@@ -25,12 +50,12 @@ def test_use_car_in_with_context(car_mocks: dict[str, MagicMock]) -> None:
     assert get_mpu_data_mock.call_count == 30
 
 
-def test_constructor_with_dry_run(car_mocks: dict[str, MagicMock]) -> None:
+def test_constructor_with_dry_run(mocker) -> None:
     # given
-    socket_mock = car_mocks["socket"]
-    socket_class_mock = car_mocks["socket_class"]
-    get_mpu_data_mock = car_mocks["get_mpu_data"]
-    set_head_angle_mock = car_mocks["set_head_angle"]
+    socket_class_mock = mocker.patch("elegoo_robot_car4.car.socket.socket")
+    socket_mock = socket_class_mock.return_value
+    get_mpu_data_mock = mocker.patch.object(Car, "get_mpu_data")
+    set_head_angle_mock = mocker.patch.object(Car, "set_head_angle")
 
     # when
     with Car(dry_run=True):
@@ -44,6 +69,22 @@ def test_constructor_with_dry_run(car_mocks: dict[str, MagicMock]) -> None:
     set_head_angle_mock.assert_not_called()
 
 
+def test_constructor_disables_nagle_algorithm(
+    car_mocks: dict[str, MagicMock],
+) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+
+    # when
+    with Car():
+        pass
+
+    # then
+    socket_mock.setsockopt.assert_any_call(
+        socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+    )
+
+
 def test_setting_head_scan_step(car_mocks: dict[str, MagicMock]) -> None:
     # given
     new_head_scan_step = 27
@@ -57,11 +98,9 @@ def test_setting_head_scan_step(car_mocks: dict[str, MagicMock]) -> None:
     assert expected_step_angle == car.head_angle_scan_step
 
 
-def test_capture(car_mocks: dict[str, MagicMock]) -> None:
-    # given
-    with Car() as car:
-        # when
-        frame = car.capture()
+def test_capture(car: Car) -> None:
+    # given, when
+    frame = car.capture()
 
     # then
     assert isinstance(frame, np.ndarray), "Correct frame type"
@@ -80,62 +119,75 @@ def test_capture_with_dry_run() -> None:
     assert frame.size == 0
 
 
-def test_turn_by(car_mocks: dict[str, MagicMock]) -> None:
+def test_turn_by(car: Car, car_mocks: dict[str, MagicMock]) -> None:
     # given
     angle: int = 30  # turn by 30 degrees, counterclockwise
     get_mpu_data_mock = car_mocks["get_mpu_data"]
 
     # when
-    with Car() as car:
-        initial_get_mpu_calls = get_mpu_data_mock.call_count
-        car.turn_by(angle=angle)
+    car.turn_by(angle=angle)
 
     # then
     assert car.state == "stop"
     expected_get_mpu_calls = 4
-    actual_get_mpu_calls = get_mpu_data_mock.call_count - initial_get_mpu_calls
-    assert expected_get_mpu_calls == actual_get_mpu_calls
+    assert expected_get_mpu_calls == get_mpu_data_mock.call_count
 
 
-def test_move_no_command_received(car_mocks: dict[str, MagicMock]) -> None:
+def test_integrate_angular_velocity() -> None:
+    # given
+    t = np.array([0.0, 1.0, 2.0, 4.0])
+    omega = np.array([0.0, 10.0, 10.0, 20.0])
+
+    # when
+    angles = Car.integrate_angular_velocity(t, omega)
+
+    # then
+    expected_angles = np.array([0.0, 5.0, 15.0, 45.0])
+    np.testing.assert_allclose(angles, expected_angles)
+
+
+def test_move_no_command_received(
+    car: Car, car_mocks: dict[str, MagicMock]
+) -> None:
     # given
     socket_mock = car_mocks["socket"]
 
     # when
-    with Car() as car:
-        car.move()
+    car.move()
 
     # then
     assert car.state == "stop"
-    expected_call_arg = b'{"H": "stop", "N": 100}'
+    expected_call_arg = b'{"H":"stop","N":100}'
     socket_mock.sendall.assert_called_with(expected_call_arg)
 
 
-def test_move_one_command_received(car_mocks: dict[str, MagicMock]) -> None:
+def test_move_one_command_received(
+    car: Car, car_mocks: dict[str, MagicMock]
+) -> None:
     # given
     socket_mock = car_mocks["socket"]
 
     # when
-    with Car() as car:
-        car.forward(speed=40, lazy=True)
-        car.move()
+    car.forward(speed=40, lazy=True)
+    car.move()
 
     # then
-    expected_call_arg = b'{"H": "fw_40", "N": 102, "D1": 1, "D2": 40}'
+    expected_call_arg = b'{"H":"fw_40","N":102,"D1":1,"D2":40}'
     socket_mock.sendall.assert_called_with(expected_call_arg)
     assert car.state == "fw_40"
 
 
-def test_move_many_commands_received(car_mocks: dict[str, MagicMock]) -> None:
+def test_move_many_commands_received(
+    car: Car, car_mocks: dict[str, MagicMock]
+) -> None:
     # given
     socket_mock = car_mocks["socket"]
 
     # when
-    with Car() as car:
-        car.forward(speed=100, lazy=True)
-        car.backward_left(speed=30, lazy=True)
-        car.forward_left(speed=70, lazy=True)
-        car.move()
+    car.forward(speed=100, lazy=True)
+    car.backward_left(speed=30, lazy=True)
+    car.forward_left(speed=70, lazy=True)
+    car.move()
 
     # then
     socket_mock.sendall.assert_not_called()
@@ -143,44 +195,57 @@ def test_move_many_commands_received(car_mocks: dict[str, MagicMock]) -> None:
 
 
 def test_no_state_change_when_receiving_consecutive_identical_commands(
+    car: Car,
     car_mocks: dict[str, MagicMock],
 ) -> None:
     # given
     socket_mock = car_mocks["socket"]
 
     # when
-    with Car() as car:
-        car.forward(speed=40, lazy=True)
-        car.move()
-        car.forward(speed=40, lazy=True)
-        car.move()
+    car.forward(speed=40, lazy=True)
+    car.move()
+    car.forward(speed=40, lazy=True)
+    car.move()
 
     # then
-    expected_call_arg = b'{"H": "fw_40", "N": 102, "D1": 1, "D2": 40}'
+    expected_call_arg = b'{"H":"fw_40","N":102,"D1":1,"D2":40}'
     socket_mock.sendall.assert_called_once_with(expected_call_arg)
     assert car.state == "fw_40"
 
 
-def test_lazy_change_state_to_stop(car_mocks: dict[str, MagicMock]) -> None:
+def test_lazy_change_state_to_stop(
+    car: Car, car_mocks: dict[str, MagicMock]
+) -> None:
     # given
     socket_mock = car_mocks["socket"]
 
     # when
-    with Car() as car:
-        car.forward(speed=40, lazy=True)
-        car.move()
-        car.stop(lazy=True)
-        car.move()
+    car.forward(speed=40, lazy=True)
+    car.move()
+    car.stop(lazy=True)
+    car.move()
 
     # then
-    expected_call_arg = b'{"H": "stop", "N": 100}'
+    expected_call_arg = b'{"H":"stop","N":100}'
     socket_mock.sendall.assert_called_with(expected_call_arg)
     assert car.state == "stop"
 
 
-def test_find_best_front_direction(
-    mocker, car_mocks: dict[str, MagicMock]
-) -> None:
+def test_forward_until(car: Car, car_mocks: dict[str, MagicMock]) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+    checks = iter([False, False, True])
+
+    # when
+    car.forward_until(has_to_stop=lambda: next(checks))
+
+    # then
+    expected_call_arg = b'{"H":"stop","N":100}'
+    socket_mock.sendall.assert_called_with(expected_call_arg)
+    assert next(checks, None) is None, "Stopping condition checked 3 times"
+
+
+def test_find_best_front_direction(mocker, car: Car) -> None:
     # given
     scan_range = (-100, -30)
     mocker.patch.object(
@@ -190,8 +255,7 @@ def test_find_best_front_direction(
     )
 
     # when
-    with Car() as car:
-        best_angle, best_distance = car.find_best_front_direction(scan_range)
+    best_angle, best_distance = car.find_best_front_direction(scan_range)
 
     # then
     expected_best_angle = -50
@@ -200,34 +264,59 @@ def test_find_best_front_direction(
     assert expected_best_distance == best_distance
 
 
-def test_set_head_angle_with_dry_run(car_mocks: dict[str, MagicMock]) -> None:
+def test_find_best_front_direction_with_ties(mocker, car: Car) -> None:
     # given
-    socket_mock = car_mocks["socket"]
+    scan_range = (-20, 20)
+    mocker.patch.object(
+        Car,
+        "get_ultrasonic_value",
+        side_effect=[40.0, 90.0, 90.0, 90.0, 90.0],
+    )
+
+    # when
+    best_angle, best_distance = car.find_best_front_direction(scan_range)
+
+    # then
+    expected_best_angle = 10
+    expected_best_distance = 90.0
+    assert expected_best_angle == best_angle
+    assert expected_best_distance == best_distance
+    assert type(best_angle) is int
+    assert type(best_distance) is float
+
+
+def test_set_head_angle_with_dry_run(mocker) -> None:
+    # given
+    socket_class_mock = mocker.patch("elegoo_robot_car4.car.socket.socket")
+    socket_mock = socket_class_mock.return_value
 
     # when
     with Car(dry_run=True) as car:
         car.set_head_angle(angle=90)
 
     # then
-    socket_mock.recv.assert_not_called()
+    socket_mock.recv_into.assert_not_called()
 
 
-def test_clear_all_states_with_dry_run(car_mocks: dict[str, MagicMock]) -> None:
+def test_clear_all_states_with_dry_run(mocker) -> None:
     # given
-    socket_mock = car_mocks["socket"]
+    socket_class_mock = mocker.patch("elegoo_robot_car4.car.socket.socket")
+    socket_mock = socket_class_mock.return_value
 
     # when
     with Car(dry_run=True) as car:
         car.clear_all_states()
 
     # then
-    socket_mock.recv.assert_not_called()
+    socket_mock.recv_into.assert_not_called()
 
 
-def test_toggle_vision_tracking_mode(car_mocks: dict[str, MagicMock]) -> None:
+def test_toggle_vision_tracking_mode(
+    vision_car: Car, car_mocks: dict[str, MagicMock]
+) -> None:
     # given
     yolo_class_mock = car_mocks["yolo_class_mock"]
-    car = Car()
+    car = vision_car
 
     # then
     assert not car.vision_tracking_is_on
@@ -248,10 +337,11 @@ def test_toggle_vision_tracking_mode(car_mocks: dict[str, MagicMock]) -> None:
 
 
 def test_vision_tracking_when_it_is_enabled(
+    vision_car: Car,
     car_mocks: dict[str, MagicMock],
 ) -> None:
     # given
-    car = Car()
+    car = vision_car
     car.toggle_vision_tracking()
     test_frame = np.array([])
     yolo_model_mock = car_mocks["yolo_model_mock"]
@@ -264,10 +354,11 @@ def test_vision_tracking_when_it_is_enabled(
 
 
 def test_vision_tracking_when_it_is_disabled(
+    vision_car: Car,
     car_mocks: dict[str, MagicMock],
 ) -> None:
     # given
-    car = Car()
+    car = vision_car
     test_frame = np.array([])
     yolo_model_mock = car_mocks["yolo_model_mock"]
 
@@ -276,3 +367,104 @@ def test_vision_tracking_when_it_is_disabled(
 
     # then
     yolo_model_mock.track.assert_not_called()
+
+
+def test_vision_tracking_with_custom_model(
+    car_mocks: dict[str, MagicMock],
+) -> None:
+    # given
+    yolo_class_mock = car_mocks["yolo_class_mock"]
+
+    # when
+    with Car(yolo_model="yolo26n.engine") as car:
+        car.toggle_vision_tracking()
+
+    # then
+    yolo_class_mock.assert_called_once_with("yolo26n.engine")
+
+
+def test_receive_with_keepalives_split_across_reads(
+    car_mocks: dict[str, MagicMock],
+) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+    stream_to_socket(
+        socket_mock, b"{Heart", b"beat}{o", b"k}{<ID>_42}{Heartbeat}"
+    )
+
+    # when
+    with Car() as car:
+        ir_value = car.get_ir_value(Car.IR_LEFT)
+
+    # then
+    assert ir_value == 42
+
+
+def test_receive_message_split_mid_token(
+    car_mocks: dict[str, MagicMock],
+) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+    stream_to_socket(socket_mock, b"{<ID>_1", b"23}")
+
+    # when
+    with Car() as car:
+        distance = car.get_ultrasonic_value()
+
+    # then
+    assert distance == pytest.approx(-0.37779223 + 1.26030353 * 123)
+
+
+def test_receive_resyncs_after_truncated_message(
+    car_mocks: dict[str, MagicMock],
+) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+    stream_to_socket(socket_mock, b"junk{garb{<ID>_true}")
+
+    # when
+    with Car() as car:
+        obstacle = car.check_obstacle()
+
+    # then
+    assert obstacle
+
+
+def test_receive_leaves_unmatched_messages_queued(
+    car_mocks: dict[str, MagicMock],
+) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+
+    def early_reply_then_reply(cmd_id: bytes) -> bytes:
+        # The reply to the next command arrives before the one to this command
+        next_id = int(cmd_id.rsplit(b"_", 1)[1]) + 1
+        return b"{clear_all_states_%d_ok}{%s_false}" % (next_id, cmd_id)
+
+    stream_to_socket(socket_mock, early_reply_then_reply)
+
+    # when
+    with Car() as car:
+        far_from_the_ground = car.is_far_from_the_ground()
+        car.clear_all_states()
+
+    # then
+    assert not far_from_the_ground
+    socket_mock.recv_into.assert_called_once()
+
+
+def test_receive_mpu_data(car_mocks: dict[str, MagicMock]) -> None:
+    # given
+    socket_mock = car_mocks["socket"]
+    stream_to_socket(
+        socket_mock, b'{"id":"<ID>","t":1500,"a":[16384,0,0],"g":[131,0,-131]}'
+    )
+
+    # when
+    with Car() as car:
+        data = car.receive_mpu_data(car.request_mpu_data())
+
+    # then
+    assert data["t"] == 1.5
+    np.testing.assert_allclose(data["a"], [-1.0, 0.0, 0.0])
+    np.testing.assert_allclose(data["g"], [1.0, 0.0, -1.0], rtol=1e-3)
@@ -9,15 +9,40 @@ from ultralytics.engine.results import Results
 from elegoo_robot_car4 import Car
 from elegoo_robot_car4.person_follower import PersonFollower
 
+# The follower only reads the frame shape, so all the results share one
+# read-only black frame, with no pixel memory behind it
+_ORIG_IMG = np.broadcast_to(np.uint8(0), (600, 800, 3))
+
+# Person boxes, in (x1, y1, x2, y2, confidence, class) format
+_BOXES = {
+    "close": torch.tensor([[0.0, 0.0, 800.0, 600.0, 0.9, 0.0]]),
+    "far_away": torch.tensor([[398.0, 298.0, 402.0, 302.0, 0.9, 0.0]]),
+    "on_the_left": torch.tensor([[0.0, 298.0, 100.0, 302.0, 0.9, 0.0]]),
+    "on_the_right": torch.tensor([[700.0, 298.0, 800.0, 302.0, 0.9, 0.0]]),
+}
+_NO_BOXES = torch.empty((0, 6))
+
 
 @pytest.fixture(scope="function")
 def follower(
-    car_motion_mocks: dict[str, MagicMock], frame_shape_hw: np.ndarray
+    car: Car,
+    car_motion_mocks: dict[str, MagicMock],
+    frame_shape_hw: np.ndarray,
 ) -> PersonFollower:
-    car = Car()
+    # The motion mocks are requested after car, so that they are reset after
+    # the shared car
     return PersonFollower(car, frame_shape_hw)
 
 
+@pytest.fixture(scope="module")
+def person_results() -> dict[str, list[Results]]:
+    # Built once per module, since the follower only reads them
+    return {
+        position: [Results(orig_img=_ORIG_IMG, path="", names={}, boxes=boxes)]
+        for position, boxes in _BOXES.items()
+    }
+
+
 def test_follow_without_track_results(
     car_motion_mocks: dict[str, MagicMock],
     follower: PersonFollower,
@@ -39,30 +64,7 @@ def test_follow_with_no_track_boxes(
             orig_img=np.array([]),
             path="",
             names={},
-            boxes=torch.Tensor(size=(0, 6)),
-        )
-    ]
-
-    # when
-    follower.follow(last_track_results=last_track_results)
-
-    # then
-    car_motion_mocks["car_stop"].assert_called_once()
-    car_motion_mocks["car_move"].assert_called_once()
-
-
-def test_follow_with_detected_person_close(
-    car_motion_mocks: dict[str, MagicMock],
-    follower: PersonFollower,
-    frame_shape_hw: np.ndarray,
-) -> None:
-    # given
-    last_track_results = [
-        Results(
-            orig_img=np.ndarray(shape=frame_shape_hw),
-            path="",
-            names={},
-            boxes=torch.Tensor([[0.0, 0.0, 800.0, 600.0, 0.9, 0.0]]),
+            boxes=_NO_BOXES,
         )
     ]
 
@@ -70,86 +72,34 @@ def test_follow_with_detected_person_close(
     follower.follow(last_track_results=last_track_results)
 
     # then
-    car_motion_mocks["car_forward"].assert_not_called()
-    car_motion_mocks["car_left"].assert_not_called()
-    car_motion_mocks["car_right"].assert_not_called()
     car_motion_mocks["car_stop"].assert_called_once()
     car_motion_mocks["car_move"].assert_called_once()
 
 
-def test_follow_with_detected_person_far_away(
-    car_motion_mocks: dict[str, MagicMock],
-    follower: PersonFollower,
-    frame_shape_hw: np.ndarray,
-) -> None:
-    # given
-    last_track_results = [
-        Results(
-            orig_img=np.ndarray(shape=frame_shape_hw),
-            path="",
-            names={},
-            boxes=torch.Tensor([[398.0, 298.0, 402.0, 302.0, 0.9, 0.0]]),
-        )
-    ]
-
-    # when
-    follower.follow(last_track_results=last_track_results)
-
-    # then
-    car_motion_mocks["car_forward"].assert_called_once()
-    car_motion_mocks["car_left"].assert_not_called()
-    car_motion_mocks["car_right"].assert_not_called()
-    car_motion_mocks["car_stop"].assert_not_called()
-    car_motion_mocks["car_move"].assert_called_once()
-
-
-def test_follow_with_detected_person_on_the_left(
-    car_motion_mocks: dict[str, MagicMock],
-    follower: PersonFollower,
-    frame_shape_hw: np.ndarray,
-) -> None:
-    # given
-    last_track_results = [
-        Results(
-            orig_img=np.ndarray(shape=frame_shape_hw),
-            path="",
-            names={},
-            boxes=torch.Tensor([[0.0, 298.0, 100.0, 302.0, 0.9, 0.0]]),
-        )
-    ]
-
-    # when
-    follower.follow(last_track_results=last_track_results)
-
-    # then
-    car_motion_mocks["car_forward"].assert_not_called()
-    car_motion_mocks["car_left"].assert_called_once()
-    car_motion_mocks["car_right"].assert_not_called()
-    car_motion_mocks["car_stop"].assert_not_called()
-    car_motion_mocks["car_move"].assert_called_once()
-
-
-def test_follow_with_detected_person_on_the_right(
+@pytest.mark.parametrize(
+    "position, expected_action",
+    [
+        ("close", "stop"),
+        ("far_away", "forward"),
+        ("on_the_left", "left"),
+        ("on_the_right", "right"),
+    ],
+)
+def test_follow_with_detected_person(
     car_motion_mocks: dict[str, MagicMock],
     follower: PersonFollower,
-    frame_shape_hw: np.ndarray,
+    person_results: dict[str, list[Results]],
+    position: str,
+    expected_action: str,
 ) -> None:
-    # given
-    last_track_results = [
-        Results(
-            orig_img=np.ndarray(shape=frame_shape_hw),
-            path="",
-            names={},
-            boxes=torch.Tensor([[700.0, 298.0, 800.0, 302.0, 0.9, 0.0]]),
-        )
-    ]
-
-    # when
-    follower.follow(last_track_results=last_track_results)
+    # given, when
+    follower.follow(last_track_results=person_results[position])
 
     # then
-    car_motion_mocks["car_forward"].assert_not_called()
-    car_motion_mocks["car_left"].assert_not_called()
-    car_motion_mocks["car_right"].assert_called_once()
-    car_motion_mocks["car_stop"].assert_not_called()
+    for action in ("forward", "left", "right", "stop"):
+        action_mock = car_motion_mocks[f"car_{action}"]
+        if action == expected_action:
+            action_mock.assert_called_once()
+        else:
+            action_mock.assert_not_called()
     car_motion_mocks["car_move"].assert_called_once()